@@ -1,23 +1,31 @@
 import math
-from typing import Dict, Any, List
+import functools
 import json
+import re
 import logging
 import sys
+import threading
 from datetime import datetime
-from datetime import timedelta
 import argparse
 import os
-import io
 import requests
-import music_tag
+from requests.adapters import HTTPAdapter, Retry
 from traceback import format_exc
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from io import BytesIO
-from ytmusicapi import YTMusic
-from yt_dlp import YoutubeDL
 from urllib.parse import urlparse
 from urllib.parse import parse_qs
 
+# orjson is optional, it speeds up writing JSON files
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ytmusicapi, yt_dlp, music_tag and PIL take a while to load, they are imported
+# after arguments are checked (PIL when first needed), so help is shown without
+# waiting for them
+
 
 # Configuration and declarations
 __version = "1.1"
@@ -44,6 +52,8 @@ default_config = {
     "datetime_format": "%d-%m-%Y %H-%M-%S",
     "unknown_placeholder": "Unknown",
     "skip_already_archive_message": False,
+    "concurrent_downloads": 1,  # Number of songs downloaded at the same time
+    "fragment_downloads": 4,  # Number of fragments yt-dlp downloads at the same time
 }
 
 formats_ext = ["opus", "m4a", "mp3"]
@@ -57,7 +67,32 @@ song_types = {
     "MUSIC_VIDEO_TYPE_OFFICIAL_SOURCE_MUSIC": "Video",
 }
 
-playlist_identifiers = ["PLLL", "PLNR"]
+playlist_identifiers = ("PLLL", "PLNR")
+# Characters that can't be found in a plain ID
+invalid_id_chars = frozenset(" /\\'\"!@#$%^&*()`~+=[]{};:,.<>?")
+
+# Bracket pair with at least one character and no brackets inside
+output_template_re = re.compile(r"\{([^{}]+)\}")
+
+# Keys of each data structure not available as-is in the output template
+template_song_skip = frozenset(
+    ["artists", "album", "lyrics", "lyrics_source", "playlist", "cover"]
+)
+template_album_skip = frozenset(["artists", "songs", "cover"])
+template_playlist_skip = frozenset(["authors", "songs", "description"])
+# Date and time template keys, with the config key of their format
+template_date_keys = {
+    "date": "date_format",
+    "time": "time_format",
+    "datetime": "datetime_format",
+    "date_time": "datetime_format",
+}
+# Template key prefixes, with the fields to skip and the artist-like field names
+template_scopes = {
+    "song": (template_song_skip, "artist", "artists"),
+    "album": (template_album_skip, "artist", "artists"),
+    "playlist": (template_playlist_skip, "author", "authors"),
+}
 
 # Schemas for each data structure
 song_schema = {
@@ -103,10 +138,15 @@ artist_schema = {"name": str, "id": str}
 
 # Declare objects
 ytm = None
+YoutubeDL = None  # yt_dlp.YoutubeDL, imported in main()
+music_tag = None  # Imported in main()
 parser: argparse.ArgumentParser
 args: dict
 log: logging.Logger
-archive = list()
+archive = set()  # IDs of songs in the archive
+archive_file = None
+archive_lock = threading.Lock()
+output_templates = dict()  # Compiled output templates
 stats = {
     "songs": 0,
     "albums": 0,
@@ -115,136 +155,200 @@ stats = {
     "warnings": 0,
     "has_notified_limit_reached": False,
 }
+stats_lock = threading.Lock()
+downloads_cancelled = threading.Event()  # Set to stop running downloads
+output_files_active = set()  # Output files of the songs being downloaded
+output_files_lock = threading.Lock()
+
+# HTTP session for cover art downloads, keeps connections alive between requests
+http_session = requests.Session()
+http_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(total=3, backoff_factor=0.3),
+    ),
+)
+# Cover art is downloaded in the background, while the audio is downloading
+cover_executor = ThreadPoolExecutor(max_workers=8)
+
+
+# Command line arguments, as (flags, options) passed to add_argument
+# The default base path (current working directory) is set when parsing
+arguments = (
+    (
+        ("urls",),
+        dict(metavar="URL", type=str, nargs="+", help="List of URL(s) to download"),
+    ),
+    (
+        ("-f", "--format"),
+        dict(
+            type=str.lower,
+            choices=formats_ext,
+            default=default_config["format"],
+            help="Audio output format",
+        ),
+    ),
+    (
+        ("-q", "--quality"),
+        dict(
+            type=int,
+            default=default_config["quality"],
+            help="Audio quality: VBR (best: 0 - worst: 9) or CBR (e.g. 256)",
+        ),
+    ),
+    (
+        ("-p", "--base-path"),
+        dict(
+            type=str,
+            help="Base output path (default is current working directory)",
+        ),
+    ),
+    (
+        ("-o", "--output-template"),
+        dict(
+            type=str,
+            default=default_config["output_template"],
+            help="Output template for downloaded songs",
+        ),
+    ),
+    (
+        ("-a", "--archive"),
+        dict(
+            type=str,
+            help="Path to file that keeps record of the downloaded songs",
+        ),
+    ),
+    (
+        ("-b", "--batch"),
+        dict(
+            action="store_true",
+            help="R|Treat URL arguments as paths to files containing a list of URLs or IDs (one per line)"
+            + '\nSpecify "-" for input to be taken from console (stdin)',
+        ),
+    ),
+    (
+        ("--account-headers",),
+        dict(
+            type=str,
+            help="R|Path to file containing authentication headers"
+            + "\nAllows special URL placeholder values to be used.",
+        ),
+    ),
+    (
+        ("--write-json",),
+        dict(
+            action="store_true",
+            help="Write JSON with information about each song (follows output template)",
+        ),
+    ),
+    (
+        ("--cover-format",),
+        dict(
+            type=str.lower,
+            choices=cover_formats,
+            default=default_config["cover_format"],
+            help=f"Set the cover image format ({' or '.join(cover_formats)})",
+        ),
+    ),
+    (
+        ("--write-cover",),
+        dict(
+            action="store_true",
+            help="Write each song's album cover to a file (follows output template)",
+        ),
+    ),
+    (
+        ("--write-lyrics",),
+        dict(
+            action="store_true",
+            help="Write each song's lyrics to a file (follows output template)",
+        ),
+    ),
+    (("--no-lyrics",), dict(action="store_true", help="Don't obtain lyrics")),
+    (
+        ("--skip-existing",),
+        dict(action="store_true", help="Skip over existing files"),
+    ),
+    (
+        ("--skip-download",),
+        dict(action="store_true", help="Skip downloading songs"),
+    ),
+    (
+        ("--download-limit",),
+        dict(
+            type=int,
+            default=default_config["download_limit"],
+            help="Limit the number of songs to be downloaded in an instance",
+        ),
+    ),
+    (
+        ("--playlist-limit",),
+        dict(
+            type=int,
+            default=default_config["playlist_limit"],
+            help="Limit the number of songs to be downloaded from a playlist",
+        ),
+    ),
+    (
+        ("--concurrent-downloads",),
+        dict(
+            type=int,
+            default=default_config["concurrent_downloads"],
+            help="Number of songs from an album or playlist to be downloaded at the same time",
+        ),
+    ),
+    (
+        ("--skip-already-archive-message",),
+        dict(
+            action="store_true",
+            default=default_config["skip_already_archive_message"],
+            help='Disables the "Song is already in archive, skipping it..." message',
+        ),
+    ),
+    (
+        ("-v", "--verbose"),
+        dict(
+            action="store_true",
+            help="Show all debug messages on console and log",
+        ),
+    ),
+    (("--log",), dict(type=str, help="Path to verbose log output file")),
+    (
+        ("--log-verbose",),
+        dict(action="store_true", help="Save all debug messages to the log"),
+    ),
+    (
+        ("--about",),
+        dict(
+            action="store_true",
+            help="Display version information (must specify at least one (dummy) URL)",
+        ),
+    ),
+)
+
+
+# Help formatter that keeps line breaks in help strings starting with "R|"
+class SmartFormatter(argparse.HelpFormatter):
+    def _split_lines(self, text, width):
+        if text.startswith("R|"):
+            return text[2:].splitlines()
+        return argparse.HelpFormatter._split_lines(self, text, width)
 
 
 # Set up argument parsing
 def setup_argparse():
     global parser, args
 
-    class SmartFormatter(argparse.HelpFormatter):
-        def _split_lines(self, text, width):
-            if text.startswith("R|"):
-                return text[2:].splitlines()
-            return argparse.HelpFormatter._split_lines(self, text, width)
-
     parser = argparse.ArgumentParser(
         prog="ytmusicdl.py",
         description="Downloads songs from YT Music with appropriate metadata",
         formatter_class=SmartFormatter,
     )
-    parser.add_argument(
-        "urls", metavar="URL", type=str, nargs="+", help="List of URL(s) to download"
-    )
-    parser.add_argument(
-        "-f",
-        "--format",
-        type=str.lower,
-        choices=formats_ext,
-        default=default_config["format"],
-        help="Audio output format",
-    )
-    parser.add_argument(
-        "-q",
-        "--quality",
-        type=int,
-        default=default_config["quality"],
-        help="Audio quality: VBR (best: 0 - worst: 9) or CBR (e.g. 256)",
-    )
-    parser.add_argument(
-        "-p",
-        "--base-path",
-        type=str,
-        default=os.getcwd(),
-        help="Base output path (default is current working directory)",
-    )
-    parser.add_argument(
-        "-o",
-        "--output-template",
-        type=str,
-        default=default_config["output_template"],
-        help="Output template for downloaded songs",
-    )
-    parser.add_argument(
-        "-a",
-        "--archive",
-        type=str,
-        help="Path to file that keeps record of the downloaded songs",
-    )
-    parser.add_argument(
-        "-b",
-        "--batch",
-        action="store_true",
-        help="R|Treat URL arguments as paths to files containing a list of URLs or IDs (one per line)"
-        + '\nSpecify "-" for input to be taken from console (stdin)',
-    )
-    parser.add_argument(
-        "--account-headers",
-        type=str,
-        help="R|Path to file containing authentication headers"
-        + "\nAllows special URL placeholder values to be used.",
-    )
-    parser.add_argument(
-        "--write-json",
-        action="store_true",
-        help="Write JSON with information about each song (follows output template)",
-    )
-    parser.add_argument(
-        "--cover-format",
-        type=str.lower,
-        choices=cover_formats,
-        default=default_config["cover_format"],
-        help=f"Set the cover image format (png or jpg)",
-    )
-    parser.add_argument(
-        "--write-cover",
-        action="store_true",
-        help="Write each song's album cover to a file (follows output template)",
-    )
-    parser.add_argument(
-        "--write-lyrics",
-        action="store_true",
-        help="Write each song's lyrics to a file (follows output template)",
-    )
-    parser.add_argument("--no-lyrics", action="store_true", help="Don't obtain lyrics")
-    parser.add_argument(
-        "--skip-existing", action="store_true", help="Skip over existing files"
-    )
-    parser.add_argument(
-        "--skip-download", action="store_true", help="Skip downloading songs"
-    )
-    parser.add_argument(
-        "--download-limit",
-        type=int,
-        default=default_config["download_limit"],
-        help="Limit the number of songs to be downloaded in an instance",
-    )
-    parser.add_argument(
-        "--playlist-limit",
-        type=int,
-        default=default_config["playlist_limit"],
-        help="Limit the number of songs to be downloaded from a playlist",
-    )
-    parser.add_argument(
-        "--skip-already-archive-message",
-        action="store_true",
-        default=default_config["skip_already_archive_message"],
-        help='Disables the "Song is already in archive, skipping it..." message',
-    )
-    parser.add_argument(
-        "-v",
-        "--verbose",
-        action="store_true",
-        help="Show all debug messages on console and log",
-    )
-    parser.add_argument("--log", type=str, help="Path to verbose log output file")
-    parser.add_argument(
-        "--log-verbose", action="store_true", help="Save all debug messages to the log"
-    )
-    parser.add_argument(
-        "--about",
-        action="store_true",
-        help="Display version information (must specify at least one (dummy) URL)",
-    )
+    for flags, options in arguments:
+        parser.add_argument(*flags, **options)
+    parser.set_defaults(base_path=os.getcwd())
 
     args = vars(parser.parse_args())
 
@@ -272,6 +376,12 @@ def setup_stats():
     )
 
 
+# Songs may be downloaded in parallel, so counters are updated under a lock
+def count_stat(key: str):
+    with stats_lock:
+        stats[key] += 1
+
+
 def finish_stats():
     stats["end_time"] = datetime.now()
     stats["duration"] = stats["end_time"] - stats["start_time"]
@@ -293,12 +403,10 @@ def finish_stats():
     log_msg += (
         str(stats["songs"]) + " song" + ("s" if stats["songs"] != 1 else "") + " in "
     )
-    secs = stats["duration"].total_seconds()
-    if secs > 59:
-        mins = math.floor(secs / 60)
+    mins, secs = divmod(math.floor(stats["duration"].total_seconds()), 60)
+    if mins > 0:
         log_msg += str(mins) + " minute" + ("s" if mins != 1 else "") + " and "
-        secs -= mins * 60
-    log_msg += str(math.floor(secs)) + " second" + ("s" if secs != 1 else "")
+    log_msg += str(secs) + " second" + ("s" if secs != 1 else "")
     if stats["errors"] > 0 or stats["warnings"] > 0:
         log_msg += " with "
     if stats["errors"] > 0:
@@ -318,23 +426,27 @@ def finish_stats():
 
 def check_args():
     global args
+    verbose = args["verbose"]
+    log_debug = verbose or args["log_verbose"]
 
     # Enable verbose logging for all handlers
-    if args["verbose"] or args["log_verbose"]:
+    if log_debug:
         log.setLevel(logging.DEBUG)
-    if args["verbose"]:
+    if verbose:
         for handler in log.handlers:
             handler.setLevel(logging.DEBUG)
 
     # Check if base path is relative or absolute
-    if not os.path.isabs(args["base_path"]):
+    # Environment variables are expanded once here, not for every file
+    base_path = args["base_path"] = os.path.expandvars(args["base_path"])
+    if not os.path.isabs(base_path):
         # If relative, turn it into an absolute path
-        args["base_path"] = os.path.join(os.getcwd(), args["base_path"])
+        base_path = args["base_path"] = os.path.join(os.getcwd(), base_path)
 
     # If base path doesn't exist, create it
-    if not os.path.isdir(args["base_path"]):
+    if not os.path.isdir(base_path):
         try:
-            os.mkdir(args["base_path"])
+            os.mkdir(base_path)
         except Exception:
             log.error("Could not open base path! Execution halted!")
             log.debug(format_exc())
@@ -345,7 +457,7 @@ def check_args():
         log_handler = logging.FileHandler(
             combine_path_with_base(args["log"]), encoding="utf-8"
         )
-        if args["verbose"] or args["log_verbose"]:
+        if log_debug:
             log_handler.setLevel(logging.DEBUG)
         log_formatter = logging.Formatter(
             "[%(asctime)s :: %(levelname)s :: %(filename)s :: %(funcName)s]:\n%(message)s\n"
@@ -364,32 +476,54 @@ def check_args():
 # Write dict to JSON file
 def write_out_json(my_dict, file_name):
     try:
-        s = json.dumps(my_dict, indent=2)
-        with open(file_name, "w") as fo:
-            fo.write(s)
-            fo.close()
-        return s
+        if orjson:
+            with open(file_name, "wb") as fo:
+                fo.write(orjson.dumps(my_dict, option=orjson.OPT_INDENT_2))
+        else:
+            # Serialize directly to the file, without building the whole string
+            # Written as UTF-8 text with \n line endings, the same as orjson does
+            with open(file_name, "w", encoding="utf-8", newline="\n") as fo:
+                json.dump(my_dict, fo, indent=2, ensure_ascii=False)
+        return True
     except Exception:
         log.error("Failed to write JSON!")
         log.debug(format_exc())
-        stats["errors"] += 1
+        count_stat("errors")
         return
 
 
+# Translation table for sanitize_filename
+# Characters are checked once, on their first occurrence, then looked up
+class SanitizeTable(dict):
+    allowed_chars = " .,!@#$()[]-+=_"
+
+    def __init__(self, replace: str):
+        super().__init__()
+        self.replace = replace
+
+    def __missing__(self, key: int):
+        char = chr(key)
+        if char.isalnum() or char in self.allowed_chars:
+            self[key] = key
+        else:
+            self[key] = self.replace
+        return self[key]
+
+
+sanitize_tables = dict()  # Translation tables for each replace character
+
+
+# Titles and names repeat across the songs of an album or playlist
+@functools.lru_cache(maxsize=2048)
 def sanitize_filename(
     filename: str, replace: chr = default_config["file_sanitize_replace_chr"]
 ):
-    allowed_chars = " .,!@#$()[]-+=_"
-    new_fn = ""
-    for char in filename:
-        if char.isalnum() or char in allowed_chars:
-            new_fn += char
-        else:
-            new_fn += replace
-    new_fn.strip()
-    if new_fn[-1] == ".":
-        new_fn = new_fn[:-1]
-    return new_fn
+    if replace not in sanitize_tables:
+        sanitize_tables[replace] = SanitizeTable(replace)
+    # Surrounding spaces and trailing dots are not allowed in file names
+    new_fn = filename.translate(sanitize_tables[replace]).strip().rstrip(" .")
+    # Names can't be empty, e.g. a title made only of dots
+    return new_fn or replace
 
 
 def check_output_template(templ: str):
@@ -397,165 +531,159 @@ def check_output_template(templ: str):
     if not templ.endswith(".{ext}"):
         log.error("Template string must end with '.{ext}'!")
         return False
-    if templ.count("{") != templ.count("}"):
+    brackets = templ.count("{")
+    if brackets != templ.count("}"):
         # Number of opened brackets is not equal to number of closed brackets
         return False
-    i = 0
-    while i < len(templ):
-        if templ[i] == "{":
-            open_pos = i  # Position in string where bracket was open
-            close_pos = templ.find("}", i + 1)  # Position where bracket is closed
-            if close_pos == -1 or open_pos == close_pos - 1:
-                # Bracket is not closed or there is nothing between the brackets
-                return False
-            keys = templ[open_pos + 1 : close_pos]
-            if "{" in keys:
-                # Another bracket is opened inside the pair
-                return False
-            i = close_pos
-        i += 1
-    return True
+    # Every bracket must be part of a valid pair, otherwise a bracket is not
+    # closed, there is nothing between the brackets or another bracket is
+    # opened inside the pair
+    return len(output_template_re.findall(templ)) == brackets
+
+
+def compile_output_template(templ: str):
+    # Split the template into a list of (literal, keys, after) tuples,
+    # where literal is the text before a bracket pair, keys is the tuple of
+    # alternative keys inside the brackets and after is the text following
+    # the '+' operator. Also returns the set of all keys used in the
+    # template. The template is the same for every song, so the result
+    # is cached.
+    # We assume the template is correct, as it has been checked previously
+    if templ in output_templates:
+        return output_templates[templ]
+    ops = list()
+    templ_keys = set()
+    pos = 0
+    for match in output_template_re.finditer(templ):
+        keys = match.group(1)
+        after = ""
+        # '+' operator specifies text to be added after a valid parameter
+        # Must be preceded by '|' to work (last key in list is empty)
+        if "+" in keys:
+            keys = keys.split("+")
+            after = keys[1]
+            keys = keys[0]
+        keys = tuple(keys.split("|"))
+        templ_keys.update(keys)
+        ops.append((templ[pos : match.start()], keys, after))
+        pos = match.end()
+    if pos < len(templ):
+        # Text after the last bracket pair
+        ops.append((templ[pos:], None, ""))
+    output_templates[templ] = ops, frozenset(templ_keys)
+    return output_templates[templ]
+
+
+def get_template_value(key: str, song: dict, now: datetime = None):
+    # Get the value of an output template key from the song data
+    # Returns None if the value is not available for the song
+    # Values are returned as they are in the song data, not converted to text
+    # Date and time values (all derived from the same time)
+    if key in template_date_keys:
+        return now.strftime(default_config[template_date_keys[key]])
+
+    # Values for song, album or playlist data, based on the key prefix
+    scope, _, field = key.partition("_")
+    if scope not in template_scopes:
+        return None
+    source = song if scope == "song" else song.get(scope)
+    if not source:
+        return None
+    skip, single, plural = template_scopes[scope]
+
+    # Parse artists (or playlist authors) separately
+    people = source.get(plural)
+    if field == single and people:
+        return people[0]["name"]  # First artist only
+    if field == plural and people:
+        return join_artists(people, default_config["filename_separator"])
+
+    value = source.get(field)
+    if field not in skip and not isinstance(value, (list, dict)):
+        return value
+    return None
 
 
 def parse_output_template(templ_str: str, extension: str, song: dict):
-    # Generate dict of values for the template
+    ops, templ_keys = compile_output_template(templ_str)
+    now = None
+    if not templ_keys.isdisjoint(template_date_keys):
+        now = datetime.now()
+
+    # Generate dict of values for the keys used in the template
+    # Sanitize all text values for file names, other values (e.g. numbers)
+    # are always safe to use in file names
     templ_values = dict()
-    # Parse values for song data
-    for key in song.keys():
-        if (
-            key
-            not in ["artists", "album", "lyrics", "lyrics_source", "playlist", "cover"]
-            and key is not list
-            and key is not dict
-        ):
-            templ_values["song_" + key] = str(song[key])
-    # Parse artists separately
-    if "artists" in song.keys() and len(song["artists"]) > 0:
-        templ_values["song_artist"] = song["artists"][0]["name"]  # First artist only
-        templ_values["song_artists"] = join_artists(
-            song["artists"], default_config["filename_separator"]
-        )
-
-    # Parse values for album data
-    if "album" in song.keys():
-        album = song["album"]
-        for key in album.keys():
-            if (
-                key not in ["artists", "songs", "cover"]
-                and key is not list
-                and key is not dict
-            ):
-                templ_values["album_" + key] = str(album[key])
-        # Parse artists separately
-        if "artists" in album.keys() and len(album["artists"]) > 0:
-            templ_values["album_artist"] = album["artists"][0][
-                "name"
-            ]  # First artist only
-            templ_values["album_artist"] = join_artists(album["artists"])
-
-    # Parse values for playlist data
-    if "playlist" in song.keys():
-        playlist = song["playlist"]
-        for key in playlist.keys():
-            if (
-                key not in ["authors", "songs", "description"]
-                and key is not list
-                and key is not dict
-            ):
-                templ_values["playlist_" + key] = str(playlist[key])
-        # Parse authors separately
-        if "authors" in playlist.keys() and len(playlist["authors"]) > 0:
-            templ_values["playlist_author"] = playlist["authors"][0][
-                "name"
-            ]  # First author only
-            templ_values["playlist_authors"] = join_artists(
-                playlist["authors"], default_config["filename_separator"]
-            )
-
-    # Additional values
-    templ_values["date_time"] = templ_values["datetime"] = datetime.now().strftime(
-        default_config["datetime_format"]
-    )
-    templ_values["date"] = datetime.now().strftime(default_config["date_format"])
-    templ_values["time"] = datetime.now().strftime(default_config["time_format"])
-
-    # Sanitize all template values for file names
-    for key, value in templ_values.items():
-        templ_values[key] = sanitize_filename(str(value))
+    get_value = get_template_value
+    sanitize = sanitize_filename
+    for key in templ_keys:
+        value = get_value(key, song, now)
+        if isinstance(value, str):
+            # Empty text counts as unavailable, so fallbacks still apply
+            if value:
+                templ_values[key] = sanitize(value)
+        elif value is not None:
+            templ_values[key] = str(value)
 
     # Extension shall not be sanitized
     templ_values["ext"] = extension
 
     # log.debug("Output template values: " + str(templ_values))
 
-    # Parse the string manually
-    # We assume the template is correct, as it has been checked previously
-    parsed_str = ""
-    i = 0
-    while i < len(templ_str):
-        if templ_str[i] == "{":
-            # Find bracket open-close pair
-            open_pos = i
-            close_pos = templ_str.find("}", i + 1)
-            keys = templ_str[open_pos + 1 : close_pos]
-            after = ""
-            # '+' operator specifies text to be added after a valid parameter
-            # Must be preceded by '|' to work (last key in list is empty)
-            if "+" in keys:
-                keys = keys.split("+")
-                after = keys[1]
-                keys = keys[0]
-            keys = keys.split("|")
-            val = None
-            for key in keys:
-                if key in templ_values:
-                    val = templ_values[key]
-                    break
-            if not val:
-                if keys[-1] == "":
-                    # The last key is empty and the previous keys haven't matched
-                    # Supress the placeholder string
-                    val = ""
-                    after = ""
-                else:
-                    # No key has matched to available params, using placeholder instead
-                    val = default_config["unknown_placeholder"]
-            parsed_str += val + after
-            # Jump to the closing bracket position
-            i = close_pos
-        else:
-            parsed_str += templ_str[i]
-        i += 1
-    return parsed_str
+    # Assemble the string from the compiled template
+    placeholder = default_config["unknown_placeholder"]
+    parts = list()
+    for literal, keys, after in ops:
+        parts.append(literal)
+        if keys is None:
+            # Text after the last bracket pair
+            continue
+        val = None
+        for key in keys:
+            if key in templ_values:
+                val = templ_values[key]
+                break
+        if val is None:
+            if keys[-1] == "":
+                # The last key is empty and the previous keys haven't matched
+                # Supress the placeholder string
+                val = ""
+                after = ""
+            else:
+                # No key has matched to available params, using placeholder instead
+                val = placeholder
+        parts.append(val)
+        parts.append(after)
+    return "".join(parts)
 
 
 def combine_path_with_base(path: str):
     if os.path.isabs(path):
         return path
-    return os.path.join(os.path.expandvars(args["base_path"]), path)
+    return os.path.join(args["base_path"], path)
 
 
 def load_archive():
     global archive
-    archive = list()
+    archive = set()
     if not args["archive"]:
         return False
     archive_fname = combine_path_with_base(args["archive"])
-    if os.path.exists(archive_fname):
-        try:
-            with open(archive_fname, "r") as file:
-                archive = file.read().splitlines()
-                log.debug(
-                    'Load Archive: File: "'
-                    + str(archive_fname)
-                    + '" loaded successfully!'
-                )
-                file.close()
-            return True
-        except Exception:
-            log.error("Load Archive: failed to open archive file!")
-            log.debug(format_exc())
-            return False
+    try:
+        with open(archive_fname, "r") as file:
+            archive = set(file.read().splitlines())
+            log.debug(
+                'Load Archive: File: "' + str(archive_fname) + '" loaded successfully!'
+            )
+            file.close()
+        return True
+    except FileNotFoundError:
+        # Archive file will be created when the first song is added
+        return
+    except Exception:
+        log.error("Load Archive: failed to open archive file!")
+        log.debug(format_exc())
+        return False
 
 
 def in_archive(song_id: str, show_message: bool = True):
@@ -568,23 +696,33 @@ def in_archive(song_id: str, show_message: bool = True):
 
 
 def add_to_archive(song_id: str):
-    global archive
+    global archive, archive_file
     if not args["archive"]:
         return False
-    archive.append(song_id)
-    archive_fname = combine_path_with_base(args["archive"])
     try:
-        with open(archive_fname, "a") as file:
-            file.write("\n" + song_id)
-            file.close()
+        with archive_lock:
+            archive.add(song_id)
+            # Archive file is opened once and kept open until the end of the run
+            if not archive_file:
+                archive_file = open(combine_path_with_base(args["archive"]), "a")
+            archive_file.write("\n" + song_id)
+            # Flush every entry, so the archive is kept if execution is interrupted
+            archive_file.flush()
         return True
     except Exception:
         log.error("Save Archive: failed to open archive file!")
         log.debug(format_exc())
-        stats["errors"] += 1
+        count_stat("errors")
         return False
 
 
+def close_archive():
+    global archive_file
+    if archive_file:
+        archive_file.close()
+        archive_file = None
+
+
 def check_download_limit():
     global stats
     if 0 < args["download_limit"] <= stats["songs"]:
@@ -597,70 +735,67 @@ def check_download_limit():
 
 # Join artist list with defined separator
 def join_artists(artists: list, separator: str = default_config["artist_separator"]):
-    artist_names = list()
-    for artist in artists:
-        artist_names.append(artist["name"])
-    return separator.join(artist_names)
+    # Most songs have a single artist, nothing to join
+    if len(artists) == 1:
+        return artists[0]["name"]
+    return join_artist_names(tuple(artist["name"] for artist in artists), separator)
 
 
-# Join song information with album information
-def join_song_album(song: dict, album: dict):
-    album_info = album.copy()
-    if "songs" in album_info:
-        album_info.pop("songs")
-    song_info = song.copy()
-    song_info["album"] = album_info
-    return song_info
+# The same artists are joined for every song of an album, so results are cached
+@functools.lru_cache(maxsize=256)
+def join_artist_names(artist_names: tuple, separator: str):
+    return separator.join(artist_names)
 
 
-# Join song information with playlist information
-# For use when calling download_audio from download_playlist
-def join_song_playlist(song: dict, playlist: dict):
-    playlist_info = playlist.copy()
-    if "songs" in playlist_info:
-        playlist_info.pop("songs")
-    song_info = song.copy()
-    song_info["playlist"] = playlist_info
-    return song_info
+# Join song information with its album or playlist information
+# For use when calling download_audio, key is either "album" or "playlist"
+def join_song_info(song: dict, key: str, info: dict):
+    info = {k: v for k, v in info.items() if k != "songs"}
+    return {**song, key: info}
 
 
 def load_album_yt_playlist(album_playlist_id: str):
-    album_yt_playlist = dict()
-    log.debug("Loading album playlist from YT: " + str(album_playlist_id) + "...")
+    log.debug("Loading album playlist from YT: %s...", album_playlist_id)
     album_playlist_url = "https://youtube.com/playlist?list=" + str(album_playlist_id)
     ytdl_config = {"extract_flat": True, "quiet": True}
     with YoutubeDL(ytdl_config) as ytdl:
         album_playlist = ytdl.extract_info(album_playlist_url, download=False)
-        if "entries" in album_playlist:
-            index = 0
-            for entry in album_playlist["entries"]:
-                index += 1
-                if entry["id"]:
-                    album_yt_playlist["track" + str(index)] = {
-                        "index": index,
-                        "id": entry["id"],
-                        "title": entry["title"],
-                    }
+    entries = album_playlist.get("entries") or ()
+    album_yt_playlist = {
+        f"track{index}": {"index": index, "id": entry["id"], "title": entry["title"]}
+        for index, entry in enumerate(entries, 1)
+        if entry["id"]
+    }
     # log.debug(json.dumps(album_yt_playlist))
     return album_yt_playlist if len(album_yt_playlist) > 0 else None
 
 
+# Songs of the same album (e.g. in a playlist) reuse the album response
+# Only the most recent albums are kept, library downloads span many albums
+# Returns the response with its track lookup tables, so both are dropped together
+@functools.lru_cache(maxsize=32)
+def fetch_album(album_id: str):
+    data_album = ytm.get_album(album_id)
+    if not data_album:
+        return data_album, None
+    return data_album, build_album_track_tables(data_album["tracks"])
+
+
 def get_album(album_id: str, return_original_request: bool = False):
-    log.debug("Getting information for album ID: " + album_id + "...")
+    log.debug("Getting information for album ID: %s...", album_id)
     # Get album information
     album = dict()
-    album_info = dict()
-    album_info["id"] = album_id
+    album_info = {"id": album_id}
 
     data_album = None
     try:
-        data_album = ytm.get_album(album_info["id"])
+        data_album, track_tables = fetch_album(album_info["id"])
     except Exception:
         log.error(
             "API Error: album request failed for album ID " + album_info["id"] + "."
         )
         log.debug(format_exc())
-        stats["errors"] += 1
+        count_stat("errors")
         return
 
     if data_album:
@@ -680,18 +815,30 @@ def get_album(album_id: str, return_original_request: bool = False):
         album["album"] = album_info
         if return_original_request:
             album["original_request"] = data_album
-
-        log.debug(
-            "Title: "
-            + str(album_info["title"])
-            + ", Artists: "
-            + str(join_artists(album_info["artists"]))
-            + ", Total: "
-            + str(album_info["total"])
-        )
+            album["album_track_tables"] = track_tables
+
+        # Joining artists is only worth it if the message is shown
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                "Title: %s, Artists: %s, Total: %s",
+                album_info["title"],
+                join_artists(album_info["artists"]),
+                album_info["total"],
+            )
         return album
 
 
+# Builds lookup tables to find a song in an album by its ID, title or duration
+# Tables map to the index of the first match
+def build_album_track_tables(tracks: list):
+    by_id, by_title, by_duration = dict(), dict(), dict()
+    for track_count, album_track in enumerate(tracks, 1):
+        by_id.setdefault(album_track["videoId"], track_count)
+        by_title.setdefault(album_track.get("title"), track_count)
+        by_duration.setdefault(album_track.get("duration"), track_count)
+    return by_id, by_title, by_duration
+
+
 def get_song(
     song_id: str,
     get_album_info: bool = True,
@@ -699,9 +846,8 @@ def get_song(
     show_info: bool = True,
 ):
     # Get song info from its ID
-    log.debug(f"Getting details about song ID: {song_id}")
-    song = dict()
-    song["id"] = song_id
+    log.debug("Getting details about song ID: %s", song_id)
+    song = {"id": song_id}
 
     # Get watch playlist for specific song ID
     # We need this to get most of the song info
@@ -711,7 +857,7 @@ def get_song(
     except Exception:
         log.error(f"API Error: getting watch playlist for song ID {song_id} failed!")
         log.debug(format_exc())
-        stats["errors"] += 1
+        count_stat("errors")
         return
 
     # Find our track in the watch playlist response
@@ -725,7 +871,7 @@ def get_song(
         log.error(
             f"API Error: bad response from watch playlist request for song ID: {song_id}!"
         )
-        stats["errors"] += 1
+        count_stat("errors")
         return
     try:
         # Copy data from API response to our song dict
@@ -735,8 +881,9 @@ def get_song(
             song["year"] = data_track["year"]
 
         # Song type: 'Song' or 'Video'
-        if data_track["videoType"] in song_types.keys():
-            song["type"] = song_types[data_track["videoType"]]
+        song_type = song_types.get(data_track["videoType"])
+        if song_type:
+            song["type"] = song_type
 
         # Add artists collection
         song["artists"] = data_track["artists"]
@@ -757,7 +904,7 @@ def get_song(
             except Exception:
                 log.error(f"API Error: lyrics request error for song ID {song_id}!")
                 log.debug(format_exc())
-                stats["errors"] += 1
+                count_stat("errors")
 
         # Add album information (only for songs)
         if get_album_info and "album" in data_track and song["type"] == "Song":
@@ -766,36 +913,20 @@ def get_song(
             album = get_album(data_track["album"]["id"], True)
             if album:
                 song["album"] = album["album"]
-                data_album = album["original_request"]
 
-                track_count = 0
-                track_found = 0
                 # Find track in album to get its index
+                # Tracks are matched by ID, by name if not found by ID (happens
+                # when track in album is a video instead of song) or, as a last
+                # hope, by length. Lookup tables are built with the album response.
                 log.debug("Finding song in album to get it's index")
-                for album_track in data_album["tracks"]:
-                    track_count += 1
-                    if album_track["videoId"] == song["id"]:
-                        track_found = track_count
-                        break
-                if track_found == 0:
-                    # If track not found by ID, find by name
-                    # Happens when track in album is a video instead of song
-                    log.debug("Finding song in album using alternative method 1")
-                    track_count = 0
-                    for album_track in data_album["tracks"]:
-                        track_count += 1
-                        if album_track["title"] == song["title"]:
-                            track_found = track_count
-                            break
-                if track_found == 0:
-                    # Last hope of finding track: by length
-                    log.debug("Finding song in album using alternative method 2")
-                    track_count = 0
-                    for album_track in data_album["tracks"]:
-                        track_count += 1
-                        if album_track["duration"] == song["duration"]:
-                            track_found = track_count
-                            break
+                by_id, by_title, by_duration = album["album_track_tables"]
+                track_found = by_id.get(song["id"], 0)
+                if track_found == 0 and song["title"] in by_title:
+                    log.debug("Found song in album using alternative method 1")
+                    track_found = by_title[song["title"]]
+                elif track_found == 0 and song["duration"] in by_duration:
+                    log.debug("Found song in album using alternative method 2")
+                    track_found = by_duration[song["duration"]]
 
                 if track_found > 0:
                     # Hooray, we found the track on the album
@@ -817,38 +948,60 @@ def get_song(
     except Exception:
         log.error(f"Failed to get data about song ID: {song_id}!")
         log.debug(format_exc())
-        stats["errors"] += 1
+        count_stat("errors")
         return
 
 
+# Songs from the same album usually share the cover art URL,
+# so recently downloaded covers are kept instead of fetched again
+@functools.lru_cache(maxsize=32)
+def get_cover_art(url: str, img_format: str):
+    with http_session.get(url, stream=True, timeout=10) as response:
+        response.raise_for_status()
+        # Image is already in the requested format, no need to re-encode it
+        content_type = response.headers.get("Content-Type", "").lower()
+        if content_type == "image/" + img_format.lower():
+            return response.content
+        from PIL import Image
+
+        # Image is decoded straight from the response stream
+        response.raw.decode_content = True
+        with Image.open(response.raw) as img, BytesIO() as img_byte_arr:
+            img.save(img_byte_arr, format=img_format)
+            return img_byte_arr.getvalue()
+
+
 def download_cover_art(url: str, cover_file: str = None):
     try:
-        response = requests.get(url)
-        img = Image.open(BytesIO(response.content))
         img_format = (
             "jpeg" if args["cover_format"] == "jpg" else args["cover_format"]
         ).upper()
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format=img_format)
+        img_byte_arr = get_cover_art(url, img_format)
         if cover_file:
             try:
-                img.save(cover_file, format=img_format)
+                with open(cover_file, "wb") as fo:
+                    fo.write(img_byte_arr)
                 log.info(f"Download Art: Cover art saved: {cover_file}")
             except Exception:
                 log.error(
                     f"Download Art: Failed to write cover art to file: {cover_file}"
                 )
                 log.debug(format_exc())
-                stats["errors"] += 1
-        img_byte_arr = img_byte_arr.getvalue()
+                count_stat("errors")
         return img_byte_arr
     except Exception:
         log.error("Download Art: Failed to get cover art!")
         log.debug(format_exc())
-        stats["errors"] += 1
+        count_stat("errors")
         return
 
 
+# yt-dlp progress hook, aborts the download if downloads were cancelled
+def check_downloads_cancelled(progress: dict):
+    if downloads_cancelled.is_set():
+        raise KeyboardInterrupt("Download cancelled")
+
+
 def download_audio(song: dict, show_info: bool = True):
     if in_archive(song["id"]):
         return "skip_archive"
@@ -861,152 +1014,234 @@ def download_audio(song: dict, show_info: bool = True):
             f"Downloading song: {song['title']} - {join_artists(song['artists'])} [{song['id']}]..."
         )
 
-    out_format = formats_ytdlp[args["format"]]
+    audio_format = args["format"]
+    out_format = formats_ytdlp[audio_format]
     # Output template of YT DLP must end in '%(ext)s' otherwise FFMPEG will fail.
     out_file_rel = str(parse_output_template(args["output_template"], "%(ext)s", song))
     out_file = str(combine_path_with_base(out_file_rel))
-    out_file_ext_rel = out_file_rel % {"ext": args["format"]}
+    out_file_ext_rel = out_file_rel % {"ext": audio_format}
     out_file_ext = str(combine_path_with_base(out_file_ext_rel))
 
     log.debug(
-        f'Output filename: "{out_file_rel}", output filename with extension: "{out_file_ext_rel}"'
+        'Output filename: "%s", output filename with extension: "%s"',
+        out_file_rel,
+        out_file_ext_rel,
     )
 
-    if os.path.exists(out_file_ext):
-        if args["skip_existing"]:
-            log.info(
-                f"Output file already exists: {out_file_ext_rel}, skipping over it!"
-            )
-            return "skip_existing"
-        if not os.path.isfile(out_file_ext):
+    # Songs downloading in parallel may resolve to the same output file
+    with output_files_lock:
+        if out_file_ext in output_files_active:
             log.warning(
-                f"Output file already exists: {out_file_ext_rel}, is a directory or link, skipping over it!"
+                f"Output file: {out_file_ext_rel} is already being downloaded, skipping over it!"
             )
-            stats["warnings"] += 1
+            count_stat("warnings")
             return "skip_existing"
-        else:
-            log.warning(
-                f"Output file already exists: {out_file_ext_rel}, it will be overwritten!"
-            )
-            stats["warnings"] += 1
-            # Delete file before writing over
-            try:
-                os.remove(out_file_ext)
-            except Exception:
-                log.error(
-                    f"Failed to delete existing file: {out_file_ext_rel}, file is either in use or you do not have enough permissions to delete it."
+        output_files_active.add(out_file_ext)
+
+    try:
+        if os.path.exists(out_file_ext):
+            if args["skip_existing"]:
+                log.info(
+                    f"Output file already exists: {out_file_ext_rel}, skipping over it!"
+                )
+                return "skip_existing"
+            if not os.path.isfile(out_file_ext):
+                log.warning(
+                    f"Output file already exists: {out_file_ext_rel}, is a directory or link, skipping over it!"
                 )
-                stats["errors"] += 1
-                return "fail_ioerr"
-
-    out_file_basedir = os.path.dirname(out_file_ext)
-    if not os.path.exists(out_file_basedir):
-        os.makedirs(out_file_basedir)
-
-    cover_bin = None
-    if "cover" in song:
-        cover_file = None
-        if args["write_cover"]:
-            cover_file = out_file % {"ext": args["cover_format"]}
-        cover_bin = download_cover_art(song["cover"], cover_file)
-
-    if args["write_json"]:
-        if write_out_json(song, out_file % {"ext": "json"}):
-            if show_info:
-                log.info("Song data JSON written successfully!")
-
-    if args["write_lyrics"]:
-        if "lyrics" in song and song["lyrics"]:
+                count_stat("warnings")
+                return "skip_existing"
+            else:
+                log.warning(
+                    f"Output file already exists: {out_file_ext_rel}, it will be overwritten!"
+                )
+                count_stat("warnings")
+                # Delete file before writing over
+                try:
+                    os.remove(out_file_ext)
+                except Exception:
+                    log.error(
+                        f"Failed to delete existing file: {out_file_ext_rel}, file is either in use or you do not have enough permissions to delete it."
+                    )
+                    count_stat("errors")
+                    return "fail_ioerr"
+
+        out_file_basedir = os.path.dirname(out_file_ext)
+        # Directory might be created by another download at the same time
+        os.makedirs(out_file_basedir, exist_ok=True)
+
+        cover_future = None
+        if "cover" in song:
+            cover_file = None
+            if args["write_cover"]:
+                cover_file = out_file % {"ext": args["cover_format"]}
+            cover_future = cover_executor.submit(
+                download_cover_art, song["cover"], cover_file
+            )
+
+        if args["write_json"]:
+            if write_out_json(song, out_file % {"ext": "json"}):
+                if show_info:
+                    log.info("Song data JSON written successfully!")
+
+        if args["write_lyrics"]:
+            if "lyrics" in song and song["lyrics"]:
+                try:
+                    with open(out_file % {"ext": "txt"}, "w") as fo:
+                        fo.write(song["lyrics"] + "\n\nLyrics " + song["lyrics_source"])
+                        fo.close()
+                except Exception:
+                    log.error("Failed to write lyrics to file!")
+                    count_stat("errors")
+            else:
+                log.warning("Lyrics unavailable!")
+                count_stat("warnings")
+
+        if not args["skip_download"]:
+            ytdlp_options = {
+                "format": out_format + "/bestaudio/best",
+                "quiet": default_config["supress_ytdlp_output"],
+                "outtmpl": out_file,
+                "concurrent_fragment_downloads": default_config["fragment_downloads"],
+                "progress_hooks": [check_downloads_cancelled],
+                "postprocessors": [
+                    {
+                        "key": "FFmpegExtractAudio",
+                        "preferredcodec": out_format,
+                        "preferredquality": args["quality"],
+                    }
+                ],
+            }
             try:
-                with open(out_file % {"ext": "txt"}, "w") as fo:
-                    fo.write(song["lyrics"] + "\n\nLyrics " + song["lyrics_source"])
-                    fo.close()
+                with YoutubeDL(ytdlp_options) as ytdlp:
+                    error_code = ytdlp.download(song["id"])
+                if error_code or not os.path.exists(out_file_ext):
+                    log.error(f"Failed to download song ID: {song['id']} from YouTube!")
+                    count_stat("errors")
+                    return "fail_download"
             except Exception:
-                log.error("Failed to write lyrics to file!")
-                stats["errors"] += 1
-        else:
-            log.warning("Lyrics unavailable!")
-            stats["warnings"] += 1
-
-    if not args["skip_download"]:
-        ytdlp_options = {
-            "format": out_format + "/bestaudio/best",
-            "quiet": default_config["supress_ytdlp_output"],
-            "outtmpl": out_file,
-            "postprocessors": [
-                {
-                    "key": "FFmpegExtractAudio",
-                    "preferredcodec": out_format,
-                    "preferredquality": args["quality"],
-                }
-            ],
-        }
-        try:
-            with YoutubeDL(ytdlp_options) as ytdlp:
-                error_code = ytdlp.download(song["id"])
-            if error_code or not os.path.exists(out_file_ext):
                 log.error(f"Failed to download song ID: {song['id']} from YouTube!")
-                stats["errors"] += 1
+                log.debug(format_exc())
+                count_stat("errors")
                 return "fail_download"
-        except Exception:
-            log.error(f"Failed to download song ID: {song['id']} from YouTube!")
-            log.debug(format_exc())
-            stats["errors"] += 1
-            return "fail_download"
 
-        try:
-            # Add metadata to song file
-            song_metadata = music_tag.load_file(out_file_ext)
-
-            song_comment = f"Song ID: {str(song['id'])}\n"
-            if "type" in song:
-                song_comment += f"Type: {str(song['type'])}\n"
-            song_metadata["track_title"] = song["title"]
-            song_metadata["artist"] = str(join_artists(song["artists"]))
+            try:
+                # Add metadata to song file
+                song_metadata = music_tag.load_file(out_file_ext)
+
+                song_comment = f"Song ID: {str(song['id'])}\n"
+                if "type" in song:
+                    song_comment += f"Type: {str(song['type'])}\n"
+                song_metadata["track_title"] = song["title"]
+                song_metadata["artist"] = str(join_artists(song["artists"]))
+
+                if "year" in song:
+                    song_metadata["year"] = str(song["year"])
+
+                if "lyrics" in song and song["lyrics"]:
+                    lyrics_str = str(song["lyrics"])
+                    if song["lyrics_source"]:
+                        lyrics_str += f"\n\nLyrics {str(song['lyrics_source'])}"
+                    song_metadata["lyrics"] = lyrics_str
+
+                if "album" in song:
+                    song_comment += f"Album ID: {str(song['album']['id'])}\n"
+                    song_comment += f"Album Type: {str(song['album']['type'])}\n"
+                    song_metadata["album"] = str(song["album"]["title"])
+                    song_metadata["album_artist"] = str(
+                        join_artists(song["album"]["artists"])
+                    )
+                    song_metadata["year"] = str(song["album"]["year"])
+                    song_metadata["total_tracks"] = song["album"]["total"]
+                    song_metadata["track_number"] = song["index"]
+
+                # Add cover art, waits for it to finish downloading
+                cover_bin = cover_future.result() if cover_future else None
+                if cover_bin:
+                    song_metadata["artwork"] = cover_bin
+
+                # Add comment with details
+                song_metadata["comment"] = song_comment
+
+                # Save everything
+                song_metadata.save()
+                add_to_archive(song["id"])
+                count_stat("songs")
+                if show_info:
+                    log.info(f"Song downloaded successfully!")
+                return "ok_download"
+            except Exception:
+                log.error(f"Failed to add metadata to file: {out_file_ext_rel}!")
+                log.debug(format_exc())
+                return "fail_metadata"
+        else:
+            log.info("Download skipped as specified by '--skip-download' argument!")
+            count_stat("songs")
+            add_to_archive(song["id"])
+            return "skip_download"
+    finally:
+        with output_files_lock:
+            output_files_active.discard(out_file_ext)
 
-            if "year" in song:
-                song_metadata["year"] = str(song["year"])
 
-            if "lyrics" in song and song["lyrics"]:
-                lyrics_str = str(song["lyrics"])
-                if song["lyrics_source"]:
-                    lyrics_str += f"\n\nLyrics {str(song['lyrics_source'])}"
-                song_metadata["lyrics"] = lyrics_str
-
-            if "album" in song:
-                song_comment += f"Album ID: {str(song['album']['id'])}\n"
-                song_comment += f"Album Type: {str(song['album']['type'])}\n"
-                song_metadata["album"] = str(song["album"]["title"])
-                song_metadata["album_artist"] = str(
-                    join_artists(song["album"]["artists"])
-                )
-                song_metadata["year"] = str(song["album"]["year"])
-                song_metadata["total_tracks"] = song["album"]["total"]
-                song_metadata["track_number"] = song["index"]
+def download_audio_safe(song: dict, show_info: bool = True):
+    try:
+        return download_audio(song, show_info=show_info)
+    except Exception:
+        log.error(f"Failed to download song ID: {song['id']}!")
+        log.debug(format_exc())
+        count_stat("errors")
+        return "fail_exception"
+
+
+# Download songs from an iterable (e.g. a generator that gets song data)
+# Each item is passed to the download function, which returns its result
+# Items with a song ID already handed out (as returned by song_ids) are
+# skipped, songs downloading in parallel aren't in the archive yet
+# If enabled, songs are downloaded in parallel, otherwise one by one
+# Returns list of download results
+def download_audio_batch(
+    songs, download=download_audio_safe, song_ids=lambda song: (song["id"],)
+):
+    queued = set()
 
-            # Add cover art
-            if cover_bin:
-                song_metadata["artwork"] = cover_bin
+    # Marks the song IDs of an item as queued, returns False if already queued
+    def queue(song):
+        ids = song_ids(song)
+        if queued.intersection(ids):
+            log.debug("Song ID: %s is already queued, skipping it", ids[0])
+            return False
+        queued.update(ids)
+        return True
 
-            # Add comment with details
-            song_metadata["comment"] = song_comment
+    workers = args["concurrent_downloads"]
+    if workers <= 1:
+        return [download(song) if queue(song) else "skip_queued" for song in songs]
 
-            # Save everything
-            song_metadata.save()
-            add_to_archive(song["id"])
-            stats["songs"] += 1
-            if show_info:
-                log.info(f"Song downloaded successfully!")
-            return "ok_download"
-        except Exception:
-            log.error(f"Failed to add metadata to file: {out_file_ext_rel}!")
-            log.debug(format_exc())
-            return "fail_metadata"
-    else:
-        log.info("Download skipped as specified by '--skip-download' argument!")
-        stats["songs"] += 1
-        add_to_archive(song["id"])
-        return "skip_download"
+    results = list()
+    pending = set()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for song in songs:
+            # Wait for a free worker before getting the next song
+            # Keeps the download limit accurate to a few songs
+            if len(pending) >= workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+            if not queue(song):
+                results.append("skip_queued")
+                continue
+            pending.add(executor.submit(download, song))
+        done, pending = wait(pending)
+        results.extend(future.result() for future in done)
+    except BaseException:
+        # Interrupted (e.g. Ctrl+C), drop queued songs and stop the running
+        # downloads instead of waiting for them to finish
+        downloads_cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+    return results
 
 
 def download_song(song_id: str, show_info: bool = True):
@@ -1024,8 +1259,6 @@ def download_album_with_songs(album_id: str):
     if not album_result:
         return
 
-    album_yt_playlist = None
-
     try:
         album_info = album_result["album"].copy()
         album = album_result["album"].copy()
@@ -1033,129 +1266,145 @@ def download_album_with_songs(album_id: str):
         log.info(
             f"Album title: {album['title']}, artists: {str(join_artists(album['artists']))}"
         )
-        track_count = 0
-        # For each track in album result
-        for track in album_result["original_request"]["tracks"]:
-            track_count += 1
-            if check_download_limit():
-                break
-            if not ("videoId" in track and track["videoId"]):
-                log.error(
-                    f"Failed to get data about album song {str(track_count)}: invalid or missing ID, song may be unavailable, skipping it..."
-                )
-                stats["errors"] += 1
-                continue
-            song_id = str(track["videoId"])
-            try:
-                if in_archive(song_id):
-                    continue
-                # Try to get song info
-                log.debug(f"Getting song ID: {song_id}...")
-                song = get_song(
-                    song_id,
-                    get_album_info=False,
-                    track_index=track_count,
-                    show_info=False,
-                )
-                if not song:
+
+        # Gets data for each song in the album as it is being downloaded
+        # Yields the album song and its audio counterpart (if there is one)
+        def album_songs():
+            album_yt_playlist = None
+            # For each track in album result
+            tracks = album_result["original_request"]["tracks"]
+            for track_count, track in enumerate(tracks, 1):
+                if check_download_limit():
+                    break
+                if not ("videoId" in track and track["videoId"]):
                     log.error(
-                        f"Failed to get data about song ID: {song_id}, skipping it..."
+                        f"Failed to get data about album song {str(track_count)}: invalid or missing ID, song may be unavailable, skipping it..."
                     )
-                    stats["errors"] += 1
-                song_to_dl = song
-                song_2 = None
-                # If track in album is a music video, attempt to retrieve album version
-                if (
-                    song["type"] == "Video"
-                    and default_config["album_song_instead_of_video"]
-                ):
-                    # Loading YT playlist:
-                    if not album_yt_playlist:
-                        album_playlist_id = album_result["original_request"][
-                            "audioPlaylistId"
-                        ]
-                        album_yt_playlist = load_album_yt_playlist(album_playlist_id)
-                    # Get audio counterpart ID from YT playlist
-                    if album_yt_playlist:
-                        track_key = "track" + str(track_count)
-                        if track_key in album_yt_playlist:
-                            song_2_id = album_yt_playlist[track_key]["id"]
-                            log.info(
-                                f"Song ID: {song_id} is a video, found its audio counterpart ID: {song_2_id}"
-                            )
-                            song_2 = get_song(
-                                song_2_id,
-                                get_album_info=False,
-                                track_index=track_count,
-                                show_info=False,
+                    count_stat("errors")
+                    continue
+                song_id = str(track["videoId"])
+                try:
+                    if in_archive(song_id):
+                        continue
+                    # Try to get song info
+                    log.debug("Getting song ID: %s...", song_id)
+                    song = get_song(
+                        song_id,
+                        get_album_info=False,
+                        track_index=track_count,
+                        show_info=False,
+                    )
+                    if not song:
+                        log.error(
+                            f"Failed to get data about song ID: {song_id}, skipping it..."
+                        )
+                        count_stat("errors")
+                        continue
+                    song_2 = None
+                    # If track in album is a music video, attempt to retrieve album version
+                    if (
+                        song["type"] == "Video"
+                        and default_config["album_song_instead_of_video"]
+                    ):
+                        # Loading YT playlist:
+                        if not album_yt_playlist:
+                            album_playlist_id = album_result["original_request"][
+                                "audioPlaylistId"
+                            ]
+                            album_yt_playlist = load_album_yt_playlist(
+                                album_playlist_id
                             )
-                        else:
-                            log.debug(
-                                f"Track key: {track_key} not found in YT playlist!"
+                        # Get audio counterpart ID from YT playlist
+                        if album_yt_playlist:
+                            track_key = "track" + str(track_count)
+                            if track_key in album_yt_playlist:
+                                song_2_id = album_yt_playlist[track_key]["id"]
+                                log.info(
+                                    f"Song ID: {song_id} is a video, found its audio counterpart ID: {song_2_id}"
+                                )
+                                song_2 = get_song(
+                                    song_2_id,
+                                    get_album_info=False,
+                                    track_index=track_count,
+                                    show_info=False,
+                                )
+                            else:
+                                log.debug(
+                                    "Track key: %s not found in YT playlist!",
+                                    track_key,
+                                )
+                        if not song_2:
+                            log.warning(
+                                "Song ID: "
+                                + song["id"]
+                                + " is a video, failed to find its audio counterpart, using video version instead!"
                             )
-                    if not song_2:
-                        log.warning(
+                            count_stat("warnings")
+                    elif (
+                        song["type"] == "Video"
+                        and not default_config["album_song_instead_of_video"]
+                    ):
+                        log.info(
                             "Song ID: "
-                            + song["id"]
-                            + " is a video, failed to find its audio counterpart, using video version instead!"
+                            + song_id
+                            + " is a video, but since 'album_song_instead_of_video' is set to false in config the video version will be used."
                         )
-                        stats["warnings"] += 1
-                elif (
-                    song["type"] == "Video"
-                    and not default_config["album_song_instead_of_video"]
-                ):
+
+                    song_title = song_2["title"] if song_2 else song["title"]
                     log.info(
-                        "Song ID: "
+                        f"Downloading album song {str(track_count)}: {song_title}..."
+                    )
+                except Exception:
+                    log.error(
+                        "Failed to download album song "
+                        + str(track_count)
+                        + ": "
                         + song_id
-                        + " is a video, but since 'album_song_instead_of_video' is set to false in config the video version will be used."
+                        + " !"
                     )
-
-                song_title = song_2["title"] if song_2 else song["title"]
-                log.info(f"Downloading album song {str(track_count)}: {song_title}...")
-
-                download_ok = False
-                if song_2:
-                    # Download found audio counterpart
-                    log.debug("Trying to download audio counterpart song...")
-                    result = download_audio(join_song_album(song_2, album_info))
-                    if result.startswith("fail"):
-                        log.warning(
-                            "Failed to download audio counterpart, reverting to video version!"
-                        )
-                    else:
-                        download_ok = True
-                        album["songs"].append(song_2)
-
-                if not download_ok:
-                    # Download song with ID from album
-                    download_audio(join_song_album(song, album_info))
-                    album["songs"].append(song)
-
-                continue
-            except Exception:
-                log.error(
-                    "Failed to download album song "
-                    + str(track_count)
-                    + ": "
-                    + song_id
-                    + " !"
+                    log.debug(format_exc())
+                    count_stat("errors")
+                    continue
+                yield song, song_2
+
+        # Downloads the audio counterpart if there is one, otherwise (or if it
+        # fails) the song from the album
+        def download_album_song(songs):
+            song, song_2 = songs
+            if song_2:
+                log.debug("Trying to download audio counterpart song...")
+                result = download_audio_safe(
+                    join_song_info(song_2, "album", album_info)
                 )
-                log.debug(format_exc())
-                stats["errors"] += 1
-                continue
+                if not result.startswith("fail"):
+                    album["songs"].append(song_2)
+                    return result
+                log.warning(
+                    "Failed to download audio counterpart, reverting to video version!"
+                )
+            album["songs"].append(song)
+            return download_audio_safe(join_song_info(song, "album", album_info))
+
+        # Video version may be downloaded if the counterpart fails
+        download_audio_batch(
+            album_songs(),
+            download_album_song,
+            lambda songs: tuple(song["id"] for song in songs if song),
+        )
+        # Songs downloaded in parallel may finish out of order
+        album["songs"].sort(key=lambda song: song["index"])
         log.debug("Album and song data complete!")
-        stats["albums"] += 1
+        count_stat("albums")
         return album
     except Exception:
         log.error("Failed to download album ID: " + album_id + " !")
         log.debug(format_exc())
-        stats["errors"] += 1
+        count_stat("errors")
         return
 
 
 def download_playlist(playlist_id: str, limit: int = default_config["playlist_limit"]):
-    playlist = dict()
-    playlist["id"] = playlist_id
+    playlist = {"id": playlist_id}
     data_playlist = None
     try:
         if playlist_id == "LM":
@@ -1166,7 +1415,7 @@ def download_playlist(playlist_id: str, limit: int = default_config["playlist_li
     except Exception:
         log.error("Get Playlist: API request failed for playlist ID: " + playlist_id)
         log.debug(format_exc())
-        stats["errors"] += 1
+        count_stat("errors")
         return
 
     if not data_playlist:
@@ -1176,10 +1425,10 @@ def download_playlist(playlist_id: str, limit: int = default_config["playlist_li
         playlist["title"] = str(data_playlist["title"])
         if "author" in data_playlist:
             playlist["authors"] = list()
-            if data_playlist["author"] is dict:
-                playlist["authors"].append(str(data_playlist["author"]))
-            elif data_playlist["author"] is list:
-                playlist["authors"] = str(data_playlist["author"])
+            if isinstance(data_playlist["author"], dict):
+                playlist["authors"].append(data_playlist["author"])
+            elif isinstance(data_playlist["author"], list):
+                playlist["authors"] = list(data_playlist["author"])
         if "year" in data_playlist:
             playlist["year"] = data_playlist["year"]
         if "duration" in data_playlist:
@@ -1192,7 +1441,7 @@ def download_playlist(playlist_id: str, limit: int = default_config["playlist_li
     except Exception:
         log.error("Failed to get information about playlist ID: " + playlist_id + " !")
         log.debug(format_exc())
-        stats["errors"] += 1
+        count_stat("errors")
         return
 
     try:
@@ -1204,57 +1453,62 @@ def download_playlist(playlist_id: str, limit: int = default_config["playlist_li
             + "..."
         )
         playlist["songs"] = list()
-        track_count = 0
         track_successful = 0
-        for track in data_playlist["tracks"]:
-            track_count += 1
-            if track_count > limit:
-                log.info("Playlist limit reached: " + str(limit) + "!")
-                break
-            if check_download_limit():
-                break
-            if not ("videoId" in track and track["videoId"]):
-                log.error(
-                    "Failed to get data about playlist song: invalid or missing ID, song may be unavailable, skipping it..."
-                )
-                stats["errors"] += 1
-                continue
-            song_id = str(track["videoId"])
-            try:
-                if in_archive(song_id):
-                    track_successful += 1
+
+        # Gets data for each song in the playlist as it is being downloaded
+        def playlist_songs():
+            nonlocal track_successful
+            for track_count, track in enumerate(data_playlist["tracks"], 1):
+                if track_count > limit:
+                    log.info("Playlist limit reached: " + str(limit) + "!")
+                    break
+                if check_download_limit():
+                    break
+                if not ("videoId" in track and track["videoId"]):
+                    log.error(
+                        "Failed to get data about playlist song: invalid or missing ID, song may be unavailable, skipping it..."
+                    )
+                    count_stat("errors")
                     continue
-                log.debug("Getting song ID: " + song_id + "...")
-                song = get_song(song_id, show_info=False)
-                if not song:
+                song_id = str(track["videoId"])
+                try:
+                    if in_archive(song_id):
+                        track_successful += 1
+                        continue
+                    log.debug("Getting song ID: %s...", song_id)
+                    song = get_song(song_id, show_info=False)
+                    if not song:
+                        log.error(
+                            "Failed to get data about song ID: "
+                            + song_id
+                            + ", skipping it..."
+                        )
+                        count_stat("errors")
+                        continue
+                    song["playlist_index"] = track_count
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug(
+                            "Downloading playlist song %d: %s - %s...",
+                            track_count,
+                            song["title"],
+                            join_artists(song["artists"]),
+                        )
+                    playlist["songs"].append(song)
+                except Exception:
                     log.error(
                         "Failed to get data about song ID: "
                         + song_id
                         + ", skipping it..."
                     )
-                    stats["errors"] += 1
+                    log.debug(format_exc())
+                    count_stat("errors")
                     continue
-                song["playlist_index"] = track_count
-                log.debug(
-                    "Downloading playlist song "
-                    + str(track_count)
-                    + ": "
-                    + song["title"]
-                    + " - "
-                    + join_artists(song["artists"])
-                    + "..."
-                )
-                playlist["songs"].append(song)
                 # Add playlist information to download audio
-                result = download_audio(join_song_playlist(song, playlist))
-                if result.startswith("ok") or result.startswith("skip"):
-                    track_successful += 1
-            except Exception:
-                log.error(
-                    "Failed to get data about song ID: " + song_id + ", skipping it..."
-                )
-                log.debug(format_exc())
-                stats["errors"] += 1
+                yield join_song_info(song, "playlist", playlist)
+
+        for result in download_audio_batch(playlist_songs()):
+            if result.startswith("ok") or result.startswith("skip"):
+                track_successful += 1
 
         if track_successful > 0:
             log.info(
@@ -1272,19 +1526,18 @@ def download_playlist(playlist_id: str, limit: int = default_config["playlist_li
                 + playlist["title"]
                 + "!"
             )
-        stats["playlists"] += 1
+        count_stat("playlists")
         return playlist
     except Exception:
         log.error("Failed to download songs from playlist ID: " + playlist_id + "!")
         log.debug(format_exc())
-        stats["errors"] += 1
+        count_stat("errors")
         return
 
 
 def parse_url(url: str):
     url = url.strip()
-    url_props = dict()
-    url_props["original"] = url
+    url_props = {"original": url}
 
     # Check if string is a valid URL
     if url.startswith("https://") or url.startswith("http://"):
@@ -1292,7 +1545,7 @@ def parse_url(url: str):
         parsed_url = urlparse(url)
         if parsed_url.hostname.count("youtube.com") != 1:
             log.error(f"Parse URL: Invalid URL Address: {url}!")
-            stats["errors"] += 1
+            count_stat("errors")
             return
         parsed_qs = parse_qs(parsed_url.query)
         if "watch" in url and "v" in parsed_qs:
@@ -1306,18 +1559,18 @@ def parse_url(url: str):
             url_props["id"] = parsed_url.path.rsplit("/", 1)[-1]
         else:
             log.error(f"Parse URL: Invalid URL Address: {url}!")
-            stats["errors"] += 1
+            count_stat("errors")
             return
     else:
         # Assume given string is a plain ID
-        if any(char in url for char in " /\\'\"!@#$%^&*()`~+=[]{};:,.<>?"):
+        if not invalid_id_chars.isdisjoint(url):
             log.error(f"Parse URL: Invalid ID string: {url}!")
-            stats["errors"] += 1
+            count_stat("errors")
             return
         url_props["is_url"] = False
         url_props["id"] = url
 
-    if (url_props["id"][:4] in playlist_identifiers) or url_props["id"] == "LM":
+    if url_props["id"].startswith(playlist_identifiers) or url_props["id"] == "LM":
         # ID represents a playlist
         url_props["type"] = "Playlist"
     elif url_props["id"].startswith("OLAK5uy_"):
@@ -1325,7 +1578,7 @@ def parse_url(url: str):
         # Get the album playlist ID for downloading
         url_props["type"] = "Album Playlist"
         try:
-            album_id = ytm.get_album_browse_id(url_props["playlist_id"])
+            album_id = ytm.get_album_browse_id(url_props["id"])
             if album_id:
                 url_props["type"] = "Album"
                 url_props["id"] = album_id
@@ -1334,7 +1587,7 @@ def parse_url(url: str):
                 f"Parse URL: Failed to get album browse ID for playlist ID: {url_props['id']}, using playlist ID instead"
             )
             log.debug(format_exc())
-            stats["warnings"] += 1
+            count_stat("warnings")
     elif url_props["id"].startswith("MPREb_"):
         # ID represents an album
         url_props["type"] = "Album"
@@ -1362,24 +1615,33 @@ def parse_from_stdin():
 def parse_batch(batch_file: str):
     log.debug(f"Loading batch file: {batch_file} ...")
     batch_file_abs = combine_path_with_base(batch_file)
-    # Check if file exists and is valid
-    if not os.path.exists(batch_file_abs):
-        log.error(f"Batch file: {batch_file} does not exist!")
-        stats["errors"] += 1
-        return
-    if not os.path.isfile(batch_file_abs):
-        log.error(f"Batch file: {batch_file} is not a file!")
-        stats["errors"] += 1
-        return
 
+    # Open the file directly, errors tell if it doesn't exist or isn't a file
     batch_file_lines = None
     try:
         with open(batch_file_abs, "r") as fin:
             batch_file_lines = fin.readlines()
+    except FileNotFoundError:
+        log.error(f"Batch file: {batch_file} does not exist!")
+        count_stat("errors")
+        return
+    except IsADirectoryError:
+        log.error(f"Batch file: {batch_file} is not a file!")
+        count_stat("errors")
+        return
+    except PermissionError:
+        # Opening a directory raises PermissionError on Windows
+        if os.path.isdir(batch_file_abs):
+            log.error(f"Batch file: {batch_file} is not a file!")
+        else:
+            log.error(f"Failed to open batch file: {batch_file} !")
+            log.debug(format_exc())
+        count_stat("errors")
+        return
     except Exception:
         log.error(f"Failed to open batch file: {batch_file} !")
         log.debug(format_exc())
-        stats["errors"] += 1
+        count_stat("errors")
         return
 
     log.info(f"Batch file: {batch_file} loaded successfully!")
@@ -1397,13 +1659,15 @@ def parse_special_account(key: str):
             if args["download_limit"] != default_config["download_limit"]:
                 limit = args["download_limit"]
             library_playlists = ytm.get_library_playlists(limit=limit)
-            for playlist in library_playlists:
-                if "playlistId" in playlist and playlist["playlistId"] != "LM":
-                    urls.append(playlist["playlistId"])
+            urls = [
+                playlist["playlistId"]
+                for playlist in library_playlists
+                if "playlistId" in playlist and playlist["playlistId"] != "LM"
+            ]
         except Exception:
             log.warning(f"Failed to get playlists from account library!")
             log.debug(format_exc())
-            stats["errors"] += 1
+            count_stat("errors")
     elif key == "library_albums":
         try:
             log.info("Loading albums from account library...")
@@ -1411,13 +1675,13 @@ def parse_special_account(key: str):
                 limit=default_config["library_limit"],
                 order=default_config["library_order"],
             )
-            for album in library_albums:
-                if "browseId" in album:
-                    urls.append(album["browseId"])
+            urls = [
+                album["browseId"] for album in library_albums if "browseId" in album
+            ]
         except Exception:
             log.warning(f"Failed to get playlists from account library!")
             log.debug(format_exc())
-            stats["errors"] += 1
+            count_stat("errors")
     elif key == "library_songs":
         try:
             log.info("Loading songs from account library...")
@@ -1427,13 +1691,16 @@ def parse_special_account(key: str):
             library_songs = ytm.get_library_songs(
                 limit=limit, order=default_config["library_order"]
             )
-            for song in library_songs:
-                if "videoId" in song and ("isAvailable" in song or song["isAvailable"]):
-                    urls.append(song["videoId"])
+            # Skip songs without an ID and songs marked as unavailable
+            urls = [
+                song["videoId"]
+                for song in library_songs
+                if song.get("videoId") and song.get("isAvailable", True)
+            ]
         except Exception:
             log.warning(f"Failed to get playlists from account library!")
             log.debug(format_exc())
-            stats["errors"] += 1
+            count_stat("errors")
     elif key == "liked_songs":
         try:
             log.info("Loading liked songs playlist from account library...")
@@ -1441,13 +1708,16 @@ def parse_special_account(key: str):
             if args["download_limit"] != default_config["download_limit"]:
                 limit = args["download_limit"]
             liked_songs = ytm.get_liked_songs(limit)
-            for song in liked_songs["tracks"]:
-                if "videoId" in song and ("isAvailable" in song or song["isAvailable"]):
-                    urls.append(song["videoId"])
+            # Skip songs without an ID and songs marked as unavailable
+            urls = [
+                song["videoId"]
+                for song in liked_songs["tracks"]
+                if song.get("videoId") and song.get("isAvailable", True)
+            ]
         except Exception:
             log.warning(f"Failed to get liked songs from account library!")
             log.debug(format_exc())
-            stats["errors"] += 1
+            count_stat("errors")
 
     if len(urls) == 0:
         return
@@ -1465,7 +1735,11 @@ def main():
 
     check_args()
 
-    global ytm
+    global ytm, YoutubeDL, music_tag
+    # A missing package stops the run here, before any API request
+    from ytmusicapi import YTMusic
+    from yt_dlp import YoutubeDL
+    import music_tag
 
     # Open account headers
     if args["account_headers"]:
@@ -1523,6 +1797,7 @@ def main():
             download_album_with_songs(url["id"])
 
     finish_stats()
+    close_archive()
 
 
 if __name__ == "__main__":